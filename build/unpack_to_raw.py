@@ -1,115 +1,228 @@
 import os
 import boto3
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+# S3 multipart parts must be at least 5 MiB, except for the last one
+PART_SIZE = 8 * 1024 * 1024
+MAX_UPLOAD_WORKERS = 10
+
+# Rows per record batch when scanning Parquet files
+PARQUET_BATCH_SIZE = 65536
+
+
+def _clean_texts(texts):
+    """
+    Strips whitespace from a text array and drops null or empty entries,
+    without converting the values to Python objects.
+    """
+    texts = pc.utf8_trim_whitespace(texts)
+    return pc.filter(texts, pc.not_equal(pc.utf8_length(texts), 0))
+
+
+def _read_text_batches(reader):
+    """
+    Reads the 'text' column batch by batch from an Arrow IPC reader.
+
+    Returns a list of cleaned text arrays, or None if the schema has no 'text' column.
+    """
+    text_index = reader.schema.get_field_index('text')
+    if text_index == -1:
+        return None
+
+    if isinstance(reader, pa.ipc.RecordBatchFileReader):
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        batches = reader
+
+    return [_clean_texts(batch.column(text_index)) for batch in batches]
+
+
+def _read_one_arrow(file_path):
+    """
+    Reads the cleaned 'text' column of an Arrow file, trying the IPC file
+    format first and falling back to the streaming format.
+    """
+    try:
+        with pa.memory_map(file_path, 'r') as source:
+            return _read_text_batches(pa.ipc.open_file(source))
+    except pa.ArrowInvalid:
+        with pa.memory_map(file_path, 'r') as source:
+            return _read_text_batches(pa.ipc.open_stream(source))
+
+
+def _read_one_parquet(file_path):
+    """
+    Reads the cleaned 'text' column of a Parquet file. Only that column is
+    read from disk, the other columns are pruned by the dataset scanner.
+    """
+    dataset = ds.dataset(file_path, format='parquet')
+    if 'text' not in dataset.schema.names:
+        return None
+    batches = dataset.to_batches(columns=['text'], batch_size=PARQUET_BATCH_SIZE)
+    return [_clean_texts(batch.column(0)) for batch in batches]
+
+
+def _read_one_file(file_path):
+    """
+    Dispatches a file to the Arrow or Parquet reader based on its extension.
+    Runs in a worker process, so it must stay a module-level function.
+    """
+    if file_path.endswith('.arrow'):
+        return _read_one_arrow(file_path)
+    return _read_one_parquet(file_path)
+
+
+def _iter_parts(text_chunks, part_size=PART_SIZE):
+    """
+    Encodes text arrays as newline-terminated UTF-8 and yields parts of at least
+    part_size bytes (only the last part may be smaller).
+    """
+    buffer = bytearray()
+    for chunk in text_chunks:
+        if len(chunk) == 0:
+            continue
+        buffer += ('\n'.join(chunk.to_pylist()) + '\n').encode('utf-8')
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _iter_parquet_parts(text_chunks, part_size=PART_SIZE):
+    """
+    Writes the text arrays as a single-column, Zstd-compressed Parquet file in
+    memory and yields it in parts of part_size bytes.
+    """
+    texts = pa.chunked_array([chunk.cast(pa.string()) for chunk in text_chunks], type=pa.string())
+    sink = pa.BufferOutputStream()
+    pq.write_table(
+        pa.table({'text': texts}),
+        sink,
+        compression='zstd',
+        compression_level=3,
+        # Texts are mostly unique, a dictionary would only add overhead
+        use_dictionary=False,
+        write_statistics=True
+    )
+    buffer = sink.getvalue()
+    for offset in range(0, buffer.size, part_size):
+        yield buffer.slice(offset, min(part_size, buffer.size - offset)).to_pybytes()
+
+
+def _upload_multipart(s3, parts, bucket_name, key, max_workers=MAX_UPLOAD_WORKERS):
+    """
+    Uploads an iterable of byte parts to S3 as a multipart upload, sending up to
+    max_workers parts concurrently. The upload is aborted if any part fails.
+    """
+    upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key)['UploadId']
+
+    def upload_part(part_number, body):
+        response = s3.upload_part(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            PartNumber=part_number, Body=body
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    try:
+        completed = []
+        pending = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for part_number, body in enumerate(parts, start=1):
+                # Bound the number of parts held in memory at once
+                if len(pending) >= max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    completed.extend(future.result() for future in done)
+                pending.add(executor.submit(upload_part, part_number, body))
+            completed.extend(future.result() for future in pending)
+
+        completed.sort(key=lambda part: part['PartNumber'])
+        s3.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': completed}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        raise
 
 
 def unpack_data(input_dir, bucket_name, output_file_name):
     """
     Reads local Arrow files from train, test, and dev subfolders,
     combines them, and uploads the combined text file to the specified S3 bucket.
+    If output_file_name ends with '.parquet', the texts are uploaded as a single
+    Zstd-compressed Parquet file with one 'text' column instead.
 
     Parameters:
     input_dir (str): Path to the directory containing the train, test, dev subfolders.
     bucket_name (str): Name of the S3 bucket to upload the combined file to.
-    output_file_name (str): Name of the combined text file to be uploaded to S3.
+    output_file_name (str): Name of the combined text or Parquet file to be uploaded to S3.
     """
     s3 = boto3.client('s3', endpoint_url='http://localhost:4566')
     all_texts = []
 
     # Subfolders: train, test, dev
     subfolders = ['train', 'test', 'dev']
+    file_paths = []
 
-    # Iterate through subfolders
+    # Collect the Arrow and Parquet files of every subfolder
     for subfolder in subfolders:
         subfolder_path = os.path.join(input_dir, subfolder)
         
         if os.path.exists(subfolder_path) and os.path.isdir(subfolder_path):
-            print(f"\nProcessing folder: {subfolder}")
+            print(f"\nScanning folder: {subfolder}")
             
-            for file_name in os.listdir(subfolder_path):
-                file_path = os.path.join(subfolder_path, file_name)
-                
-                # Skip if not a file
-                if not os.path.isfile(file_path):
-                    continue
-                
-                # Process Arrow files
-                if file_name.endswith('.arrow'):
-                    print(f"  Reading: {file_name}")
-                    try:
-                        # Try reading as Arrow IPC file format first
-                        try:
-                            with pa.memory_map(file_path, 'r') as source:
-                                table = pa.ipc.RecordBatchFileReader(source).read_all()
-                        except:
-                            # If that fails, try streaming format
-                            with pa.memory_map(file_path, 'r') as source:
-                                reader = pa.ipc.open_stream(source)
-                                table = reader.read_all()
-                        
-                        # Convert to pandas for easier text extraction
-                        df = table.to_pandas()
-                        
-                        # Extract text column
-                        if 'text' in df.columns:
-                            texts = df['text'].tolist()
-                            # Filter out empty texts
-                            texts = [text.strip() for text in texts if text and text.strip()]
-                            all_texts.extend(texts)
-                            print(f"    ✓ Extracted {len(texts)} non-empty texts")
-                        else:
-                            print(f"    ✗ Warning: 'text' column not found")
-                    except Exception as e:
-                        print(f"    ✗ Error reading file: {e}")
-                
-                # Process Parquet files (if present)
-                elif file_name.endswith('.parquet'):
-                    print(f"  Reading: {file_name}")
-                    try:
-                        table = pq.read_table(file_path)
-                        df = table.to_pandas()
-                        
-                        if 'text' in df.columns:
-                            texts = df['text'].tolist()
-                            texts = [text.strip() for text in texts if text and text.strip()]
-                            all_texts.extend(texts)
-                            print(f"    ✓ Extracted {len(texts)} non-empty texts")
-                        else:
-                            print(f"    ✗ Warning: 'text' column not found")
-                    except Exception as e:
-                        print(f"    ✗ Error reading file: {e}")
+            # DirEntry caches the file type from the directory read
+            with os.scandir(subfolder_path) as entries:
+                for entry in entries:
+                    # Skip if not a file
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    
+                    if entry.name.endswith(('.arrow', '.parquet')):
+                        file_paths.append(entry.path)
         else:
             print(f"\n⚠ Subfolder '{subfolder}' does not exist at {subfolder_path}")
 
-    if all_texts:
-        print(f"\nTotal texts collected: {len(all_texts)}")
-        
-        # Create a temporary directory if it doesn't exist
-        temp_dir = "temp"
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Save the combined data to a text file
-        combined_file_path = os.path.join(temp_dir, output_file_name)
-        
-        with open(combined_file_path, 'w', encoding='utf-8') as f:
-            for text in all_texts:
-                f.write(text + '\n')
+    # Read the files in parallel, each file being independent
+    if file_paths:
+        print(f"\nReading {len(file_paths)} files with up to {os.cpu_count()} processes...")
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [executor.submit(_read_one_file, file_path) for file_path in file_paths]
+            
+            for file_path, future in zip(file_paths, futures):
+                print(f"  Reading: {file_path}")
+                try:
+                    texts = future.result()
+                    if texts is not None:
+                        all_texts.extend(texts)
+                        print(f"    ✓ Extracted {sum(len(chunk) for chunk in texts)} non-empty texts")
+                    else:
+                        print(f"    ✗ Warning: 'text' column not found")
+                except Exception as e:
+                    print(f"    ✗ Error reading file: {e}")
+
+    total_texts = sum(len(chunk) for chunk in all_texts)
+    if total_texts:
+        print(f"\nTotal texts collected: {total_texts}")
         
-        print(f"Combined file saved locally at {combined_file_path}")
+        # Encode as a single Parquet file or as plain text, based on the file name
+        if output_file_name.endswith('.parquet'):
+            parts = _iter_parquet_parts(all_texts)
+        else:
+            parts = _iter_parts(all_texts)
         
-        # Upload the combined file to the S3 bucket
+        # Stream the combined data straight to the S3 bucket
         try:
-            s3.upload_file(combined_file_path, bucket_name, output_file_name)
+            _upload_multipart(s3, parts, bucket_name, output_file_name)
             print(f"Uploaded combined file to bucket '{bucket_name}' with name '{output_file_name}'")
         except Exception as e:
             print(f"Error uploading to S3: {e}")
             raise
-        
-        # Clean up local file
-        if os.path.exists(combined_file_path):
-            os.remove(combined_file_path)
-            print("Cleaned up temporary file")
     else:
         print("No valid texts found to process.")
 
@@ -120,7 +233,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Unpack WikiText Arrow files, combine, and upload to S3")
     parser.add_argument("--input_dir", type=str, required=True, help="Path to input directory")
     parser.add_argument("--bucket_name", type=str, required=True, help="Name of the S3 bucket")
-    parser.add_argument("--output_file_name", type=str, default="combined_raw.txt", help="Name of the output file for S3")
+    parser.add_argument("--output_file_name", type=str, default="combined_raw.parquet", help="Name of the output file for S3")
     args = parser.parse_args()
 
     unpack_data(args.input_dir, args.bucket_name, args.output_file_name)
\ No newline at end of file
@@ -1,23 +1,100 @@
+import os
+import tempfile
 import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
 import mysql.connector
+from itertools import islice
 from mysql.connector import Error
 
+# Errors raised when LOAD DATA LOCAL INFILE is disabled on the server
+# (ER_CLIENT_LOCAL_FILES_DISABLED, ER_NOT_ALLOWED_COMMAND) or on the client
+# (CR_LOAD_DATA_LOCAL_INFILE_REJECTED)
+LOCAL_INFILE_DISABLED_ERRORS = {3948, 1148, 2068}
+
+# Rows per executemany call when LOAD DATA is not available
+INSERT_BATCH_SIZE = 10000
+
+
+def _escape_load_data_field(text):
+    """
+    Escapes a text for LOAD DATA's default format, where backslash is the
+    escape character and tab/newline delimit fields and lines.
+    """
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def _insert_texts(cursor, texts, batch_size=INSERT_BATCH_SIZE):
+    """
+    Inserts texts with batched executemany calls, without committing.
+    Returns the number of inserted rows.
+    """
+    insert_query = "INSERT INTO texts (text) VALUES (%s)"
+    total_inserted = 0
+    for batch in _iter_batches(texts, batch_size):
+        cursor.executemany(insert_query, [(text,) for text in batch])
+        total_inserted += len(batch)
+        print(f"  Inserted {total_inserted}/{len(texts)} texts...", end='\r')
+    print()
+    return total_inserted
+
+
+def _iter_batches(items, size):
+    """
+    Groups an iterable into lists of at most size items.
+    """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _iter_lines(stream, chunk_size=1 << 20):
+    """
+    Yields the newline-separated lines of a binary stream as bytes, reading
+    it chunk by chunk instead of loading it whole.
+    """
+    buffer = b''
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        yield from lines
+    if buffer:
+        yield buffer
+
+
+def _iter_parquet_texts(stream, batch_size=65536):
+    """
+    Yields the values of the 'text' column of a Parquet file read from a
+    binary stream. The compressed file is held in memory and decoded one
+    record batch at a time. Texts are split on newlines so that staging rows
+    match the ones produced from a plain text input.
+    """
+    parquet_file = pq.ParquetFile(pa.BufferReader(stream.read()))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=['text']):
+        for text in batch.column(0).to_pylist():
+            if text is not None:
+                yield from text.split('\n')
+
 
 def preprocess_to_staging(bucket_raw, input_file, db_host, db_user, db_password, db_name):
     """
     Downloads WikiText data from raw S3 bucket, cleans it, and stores it in MySQL database.
     
     Steps:
-    1. Downloads the raw text file from the raw bucket
-    2. Cleans the data (removes duplicates and empty lines)
+    1. Opens the raw text or Parquet file from the raw bucket as a stream
+    2. Cleans the data line by line as it is read (removes duplicates and empty lines)
     3. Connects to MySQL database
     4. Creates 'texts' table if it doesn't exist
-    5. Inserts cleaned data into the table
+    5. Bulk loads cleaned data into the table with LOAD DATA LOCAL INFILE
+       (or batched INSERTs if the server has local_infile disabled)
     6. Verifies the insertion
     
     Parameters:
     bucket_raw (str): Name of the raw S3 bucket
-    input_file (str): Name of the input file in the raw bucket
+    input_file (str): Name of the input file in the raw bucket ('.parquet' files are read as Parquet)
     db_host (str): MySQL database host
     db_user (str): MySQL database user
     db_password (str): MySQL database password
@@ -30,29 +107,39 @@ def preprocess_to_staging(bucket_raw, input_file, db_host, db_user, db_password,
     
     try:
         response = s3.get_object(Bucket=bucket_raw, Key=input_file)
-        raw_text = response['Body'].read().decode('utf-8')
-        print(f"✓ Downloaded {len(raw_text)} characters from S3")
+        print(f"✓ Opened S3 object ({response['ContentLength']} bytes)")
     except Exception as e:
         print(f"✗ Error downloading from S3: {e}")
         raise
     
-    # Step 2: Clean the data
+    # Step 2: Clean the data while it is streamed from S3
     print("\nCleaning data...")
-    lines = raw_text.split('\n')
-    print(f"  Total lines: {len(lines)}")
-    
-    # Remove empty lines and strip whitespace
-    cleaned_lines = [line.strip() for line in lines if line.strip()]
-    print(f"  After removing empty lines: {len(cleaned_lines)}")
+    total_lines = 0
+    non_empty_lines = 0
+    # Remove duplicates while preserving order (dict keys keep insertion order)
+    unique_lines = {}
     
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_lines = []
-    for line in cleaned_lines:
-        if line not in seen:
-            seen.add(line)
-            unique_lines.append(line)
+    try:
+        # Parquet input is read column-wise, text input line by line
+        if input_file.endswith('.parquet'):
+            texts = _iter_parquet_texts(response['Body'])
+        else:
+            texts = (raw_line.decode('utf-8') for raw_line in _iter_lines(response['Body']))
+        
+        for text in texts:
+            total_lines += 1
+            
+            # Remove empty lines and strip whitespace
+            line = text.strip()
+            if line:
+                non_empty_lines += 1
+                unique_lines[line] = None
+    except Exception as e:
+        print(f"✗ Error reading from S3: {e}")
+        raise
     
+    print(f"  Total lines: {total_lines}")
+    print(f"  After removing empty lines: {non_empty_lines}")
     print(f"  After removing duplicates: {len(unique_lines)}")
     print(f"✓ Cleaned data: {len(unique_lines)} unique non-empty texts")
     
@@ -63,7 +150,8 @@ def preprocess_to_staging(bucket_raw, input_file, db_host, db_user, db_password,
             host=db_host,
             user=db_user,
             password=db_password,
-            database=db_name
+            database=db_name,
+            allow_local_infile=True
         )
         
         if conn.is_connected():
@@ -104,37 +192,65 @@ def preprocess_to_staging(bucket_raw, input_file, db_host, db_user, db_password,
     except Error as e:
         print(f"⚠ Warning: Could not clear table: {e}")
     
-    # Step 5: Insert cleaned data into the table
-    print(f"\nInserting {len(unique_lines)} texts into database...")
-    insert_query = "INSERT INTO texts (text) VALUES (%s)"
+    # Step 5: Bulk load cleaned data into the table
+    print(f"\nLoading {len(unique_lines)} texts into database...")
+    load_query = """
+    LOAD DATA LOCAL INFILE %s INTO TABLE texts
+    CHARACTER SET utf8mb4
+    FIELDS TERMINATED BY '\\t'
+    LINES TERMINATED BY '\\n'
+    (text)
+    """
     
+    tmp_path = None
     try:
-        # Insert in batches for better performance
-        batch_size = 1000
-        total_inserted = 0
+        # Write one escaped text per line for LOAD DATA
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='\n',
+                                         suffix='.tsv', delete=False) as f:
+            tmp_path = f.name
+            f.writelines(_escape_load_data_field(text) + '\n' for text in unique_lines)
         
-        for i in range(0, len(unique_lines), batch_size):
-            batch = unique_lines[i:i + batch_size]
-            batch_data = [(text,) for text in batch]
-            cursor.executemany(insert_query, batch_data)
-            conn.commit()
-            total_inserted += len(batch)
-            print(f"  Inserted {total_inserted}/{len(unique_lines)} texts...", end='\r')
+        # Skip per-row uniqueness and foreign key checks during the bulk load
+        cursor.execute("SET SESSION unique_checks=0")
+        cursor.execute("SET SESSION foreign_key_checks=0")
         
-        print(f"\n✓ Successfully inserted {total_inserted} texts into database")
+        # Load everything in a single transaction, committed once
+        conn.start_transaction()
+        try:
+            cursor.execute(load_query, (tmp_path,))
+            total_inserted = cursor.rowcount
+        except Error as e:
+            if e.errno not in LOCAL_INFILE_DISABLED_ERRORS:
+                raise
+            # local_infile is OFF on the server (the MySQL 8 default):
+            # fall back to batched INSERTs within the same transaction
+            print(f"⚠ LOAD DATA LOCAL INFILE is disabled ({e.msg}), falling back to INSERTs")
+            total_inserted = _insert_texts(cursor, unique_lines)
+        conn.commit()
+        
+        print(f"✓ Successfully inserted {total_inserted} texts into database")
         
     except Error as e:
         print(f"\n✗ Error inserting data: {e}")
         conn.rollback()
         conn.close()
         raise
+    finally:
+        if conn.is_connected():
+            cursor.execute("SET SESSION unique_checks=1")
+            cursor.execute("SET SESSION foreign_key_checks=1")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
     
     # Step 6: Verify the insertion
     print("\nVerifying data insertion...")
     try:
-        cursor.execute("SELECT COUNT(*) FROM texts WHERE text IS NOT NULL")
-        count = cursor.fetchone()[0]
-        print(f"✓ Verification: {count} valid rows in 'texts' table")
+        # The table was truncated before the load, so the rows reported by
+        # LOAD DATA are its row count; no need for another COUNT(*) scan
+        if total_inserted == len(unique_lines):
+            print(f"✓ Verification: {total_inserted} valid rows in 'texts' table")
+        else:
+            print(f"⚠ Verification: {total_inserted} rows loaded, {len(unique_lines)} expected")
         
         # Show a sample
         cursor.execute("SELECT id, LEFT(text, 100) as text_preview FROM texts LIMIT 5")
@@ -156,7 +272,7 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="Preprocess WikiText data from S3 to MySQL staging")
     parser.add_argument("--bucket_raw", type=str, required=True, help="Name of the raw S3 bucket")
-    parser.add_argument("--input_file", type=str, default="combined_raw.txt", help="Name of the input file in raw bucket")
+    parser.add_argument("--input_file", type=str, default="combined_raw.parquet", help="Name of the input file in raw bucket")
     parser.add_argument("--db_host", type=str, default="localhost", help="MySQL database host")
     parser.add_argument("--db_user", type=str, default="root", help="MySQL database user")
     parser.add_argument("--db_password", type=str, default="root", help="MySQL database password")
@@ -1,12 +1,288 @@
 import pymysql
 import pymongo
+import os
+import queue
+import threading
+import numpy as np
+from bson import Binary
+from itertools import chain, islice
 from transformers import AutoTokenizer
 from datetime import datetime
 
+# Let the Rust tokenizer parallelize over each batch
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+# Number of texts sent to the tokenizer in one call
+TOKENIZE_BATCH_SIZE = 1024
+
+# Number of rows fetched from MySQL per query
+MYSQL_PAGE_SIZE = 10000
+
+# Number of batches buffered between pipeline stages
+PIPELINE_QUEUE_SIZE = 4
+
+# Marks the end of a pipeline queue
+_END = object()
+
+# MongoDB client connection pool bounds
+MONGO_POOL_SIZE = 32
+MONGO_MIN_POOL_SIZE = 4
+
+# Wire compressors offered to MongoDB, in order of preference
+MONGO_COMPRESSORS = "zstd,zlib"
+
+# Connections reused across process_to_curated calls, keyed by their parameters
+_mysql_connections = {}
+_mongo_clients = {}
+
+
+def _mysql_connection(host, user, password, database):
+    """
+    Returns a MySQL connection shared by every call with the same parameters,
+    so repeated runs in one process skip the connect and auth handshake.
+    """
+    key = (host, user, password, database)
+    if key not in _mysql_connections:
+        _mysql_connections[key] = pymysql.connect(
+            host=host,
+            user=user,
+            password=password,
+            database=database,
+            autocommit=False
+        )
+    return _mysql_connections[key]
+
+
+def _mongo_client(host, port):
+    """
+    Returns a MongoDB client shared by every call with the same host and port.
+    The client keeps a pool of warm connections between runs.
+    """
+    key = (host, port)
+    if key not in _mongo_clients:
+        _mongo_clients[key] = pymongo.MongoClient(
+            f"mongodb://{host}:{port}/",
+            maxPoolSize=MONGO_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=2000,
+            # Compress the wire traffic; the first compressor also supported
+            # by the server (and installed locally) is used
+            compressors=MONGO_COMPRESSORS,
+            zlibCompressionLevel=1
+        )
+    return _mongo_clients[key]
+
+
+def close_connections():
+    """
+    Closes the pooled MySQL connections and MongoDB clients.
+    """
+    for conn in _mysql_connections.values():
+        conn.close()
+    _mysql_connections.clear()
+    
+    for client in _mongo_clients.values():
+        client.close()
+    _mongo_clients.clear()
+
+
+def _iter_text_pages(cursor, page_size):
+    """
+    Yields the rows of the 'texts' table in id order, one page at a time,
+    using keyset pagination (id > last seen id) so every query stays an
+    index range scan regardless of how far the read has progressed.
+    """
+    last_id = 0
+    while True:
+        cursor.execute(
+            "SELECT id, text FROM texts WHERE id > %s AND text IS NOT NULL ORDER BY id LIMIT %s",
+            (last_id, page_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1]['id']
+        yield rows
+
+
+def _iter_batches(rows, size):
+    """
+    Groups an iterable of rows into lists of at most size rows.
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _token_dtype(tokenizer):
+    """
+    Returns the smallest unsigned dtype able to hold every token id of the tokenizer.
+    """
+    return "uint16" if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else "uint32"
+
+
+def _pack_tokens(tokens, dtype):
+    """
+    Packs token ids into a BSON binary value. Readers decode it with
+    np.frombuffer(value, dtype=metadata["token_dtype"]).
+    """
+    return Binary(np.asarray(tokens, dtype=dtype).tobytes())
+
+
+def _tokenize_batch(tokenizer, rows):
+    """
+    Tokenizes the texts of a batch of rows in one tokenizer call and returns
+    (row, input_ids) pairs. If the batch call fails, texts are tokenized one
+    by one so that only the failing rows are skipped.
+    """
+    try:
+        encoded = tokenizer(
+            [row['text'] for row in rows],
+            truncation=True,
+            padding=False,
+            max_length=128,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )["input_ids"]
+        return list(zip(rows, encoded))
+    except Exception:
+        # Fall back to one call per text below
+        pass
+    
+    results = []
+    for row in rows:
+        try:
+            tokens = tokenizer(
+                row['text'],
+                truncation=True,
+                padding=False,
+                max_length=128,
+                return_attention_mask=False,
+                return_token_type_ids=False
+            )["input_ids"]
+        except Exception as e:
+            print(f"⚠ Warning: Failed to tokenize text ID {row['id']}: {e}")
+            continue
+        results.append((row, tokens))
+    return results
+
+
+def _drop_secondary_indexes(collection):
+    """
+    Drops every index of the collection except the mandatory _id index and
+    returns their specifications so they can be rebuilt with _restore_indexes.
+    If a drop fails, the indexes already dropped are recreated before the
+    error is re-raised.
+    """
+    index_specs = [spec for spec in collection.list_indexes() if spec['name'] != '_id_']
+    dropped_specs = []
+    try:
+        for spec in index_specs:
+            collection.drop_index(spec['name'])
+            dropped_specs.append(spec)
+    except Exception:
+        try:
+            _restore_indexes(collection, dropped_specs)
+        except Exception as e:
+            print(f"✗ Error restoring dropped indexes: {e}")
+        raise
+    return index_specs
+
+
+def _restore_indexes(collection, index_specs):
+    """
+    Recreates indexes from the specifications returned by _drop_secondary_indexes,
+    keeping their names and options (unique, sparse, TTL, ...).
+    """
+    for spec in index_specs:
+        options = {key: value for key, value in spec.items() if key not in ('key', 'v', 'ns')}
+        collection.create_index(list(spec['key'].items()), **options)
+
+
+def _run_pipeline(batches, transform, consume, flush=None, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Runs a three-stage pipeline with one thread per stage: a producer thread
+    iterates batches, a worker thread applies transform to each batch and a
+    consumer thread passes the results to consume. Stages are connected by
+    bounded queues, so reading, tokenizing and inserting overlap while
+    memory stays bounded. Once every result has been consumed, flush (if
+    given) is called from the consumer thread so that consume can buffer
+    results across calls. The first exception raised by any stage stops the
+    pipeline and is re-raised in the calling thread.
+    """
+    input_queue = queue.Queue(maxsize=queue_size)
+    output_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+    
+    def run_stage(stage):
+        try:
+            stage()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+    
+    def produce():
+        try:
+            for batch in batches:
+                if stop.is_set():
+                    return
+                put(input_queue, batch)
+        finally:
+            put(input_queue, _END)
+    
+    def work():
+        try:
+            while True:
+                batch = get(input_queue)
+                if batch is _END:
+                    return
+                put(output_queue, transform(batch))
+        finally:
+            put(output_queue, _END)
+    
+    def drain():
+        while True:
+            result = get(output_queue)
+            if result is _END:
+                if flush is not None and not stop.is_set():
+                    flush()
+                return
+            consume(result)
+    
+    threads = [threading.Thread(target=run_stage, args=(stage,), daemon=True)
+               for stage in (produce, work, drain)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    if errors:
+        raise errors[0]
+
 
 def process_to_curated(db_host, db_user, db_password, db_name, 
                        mongo_host, mongo_port, mongo_db_name, mongo_collection_name,
-                       tokenizer_model="distilbert-base-uncased", batch_size=100):
+                       tokenizer_model="distilbert-base-uncased", batch_size=1000):
     """
     Processes data from MySQL staging database, tokenizes texts, and stores in MongoDB curated database.
     
@@ -34,13 +310,11 @@ def process_to_curated(db_host, db_user, db_password, db_name,
     # Step 1: Connect to MySQL database
     print(f"Connecting to MySQL database at {db_host}...")
     try:
-        mysql_conn = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
-        cursor = mysql_conn.cursor(pymysql.cursors.DictCursor)
+        mysql_conn = _mysql_connection(db_host, db_user, db_password, db_name)
+        # Reconnect if the pooled connection was dropped since its last use,
+        # and end any transaction left open so reads see fresh data
+        mysql_conn.ping(reconnect=True)
+        mysql_conn.rollback()
         print(f"✓ Connected to MySQL database '{db_name}'")
     except Exception as e:
         print(f"✗ Error connecting to MySQL: {e}")
@@ -49,36 +323,39 @@ def process_to_curated(db_host, db_user, db_password, db_name,
     # Step 2: Query data from MySQL (direct query, no file!)
     print("\nQuerying data from MySQL staging database...")
     try:
-        cursor.execute("SELECT id, text FROM texts WHERE text IS NOT NULL")
-        print(f"✓ Query executed successfully")
-        
-        # Get total count for progress tracking
-        cursor.execute("SELECT COUNT(*) as count FROM texts WHERE text IS NOT NULL")
-        total_count = cursor.fetchone()['count']
-        print(f"✓ Total texts to process: {total_count}")
+        cursor = mysql_conn.cursor(pymysql.cursors.DictCursor)
         
-        # Re-execute the main query
-        cursor.execute("SELECT id, text FROM texts WHERE text IS NOT NULL")
+        # Estimate the total from table statistics for progress tracking,
+        # which avoids a full COUNT(*) scan
+        cursor.execute(
+            "SELECT TABLE_ROWS as count FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'texts'",
+            (db_name,)
+        )
+        row = cursor.fetchone()
+        total_count = f"~{row['count']}" if row and row['count'] is not None else "?"
+        print(f"✓ Estimated texts to process: {total_count}")
+        print(f"✓ Rows will be read in pages of {MYSQL_PAGE_SIZE}")
         
     except Exception as e:
         print(f"✗ Error querying MySQL: {e}")
-        mysql_conn.close()
         raise
     
     # Step 3: Load tokenizer
     print(f"\nLoading tokenizer: {tokenizer_model}...")
     try:
         tokenizer = AutoTokenizer.from_pretrained(tokenizer_model)
-        print(f"✓ Tokenizer loaded successfully")
+        token_dtype = _token_dtype(tokenizer)
+        print(f"✓ Tokenizer loaded successfully (tokens stored as {token_dtype})")
     except Exception as e:
         print(f"✗ Error loading tokenizer: {e}")
-        mysql_conn.close()
+        cursor.close()
         raise
     
     # Step 4: Connect to MongoDB
     print(f"\nConnecting to MongoDB at {mongo_host}:{mongo_port}...")
     try:
-        mongo_client = pymongo.MongoClient(f"mongodb://{mongo_host}:{mongo_port}/")
+        mongo_client = _mongo_client(mongo_host, mongo_port)
         mongo_db = mongo_client[mongo_db_name]
         mongo_collection = mongo_db[mongo_collection_name]
         print(f"✓ Connected to MongoDB database '{mongo_db_name}', collection '{mongo_collection_name}'")
@@ -88,72 +365,103 @@ def process_to_curated(db_host, db_user, db_password, db_name,
         result = mongo_collection.delete_many({})
         print(f"✓ Deleted {result.deleted_count} existing documents")
         
+        # Bulk load without waiting for the journal; verification below
+        # still goes through the collection's default write concern
+        load_collection = mongo_collection.with_options(
+            write_concern=pymongo.WriteConcern(w=1, j=False)
+        )
+        
+        # Drop secondary indexes during the bulk load, they are rebuilt once at the end
+        index_specs = _drop_secondary_indexes(mongo_collection)
+        if index_specs:
+            print(f"✓ Dropped {len(index_specs)} secondary indexes for the bulk load")
+        
     except Exception as e:
         print(f"✗ Error connecting to MongoDB: {e}")
-        mysql_conn.close()
+        cursor.close()
         raise
     
     # Step 5: Process and insert data
     print(f"\nProcessing and inserting data into MongoDB...")
     print(f"Batch size: {batch_size} documents\n")
     
-    try:
-        documents_batch = []
-        total_inserted = 0
-        
-        # Process each row from MySQL
-        for row in cursor:
-            text_id = row['id']
-            text = row['text']
-            
-            # Tokenize the text
-            try:
-                tokens = tokenizer(
-                    text,
-                    truncation=True,
-                    padding=True,
-                    max_length=128,
-                    return_tensors=None  # Return as list, not tensor
-                )["input_ids"]
-            except Exception as e:
-                print(f"⚠ Warning: Failed to tokenize text ID {text_id}: {e}")
-                continue
-            
+    total_inserted = 0
+    
+    def build_documents(rows):
+        documents = []
+        # One timestamp per batch, stored as a native BSON date
+        processed_at = datetime.utcnow()
+        for row, tokens in _tokenize_batch(tokenizer, rows):
             # Create MongoDB document
-            document = {
-                "id": text_id,
-                "text": text,
-                "tokens": tokens,
+            documents.append({
+                "id": row['id'],
+                "text": row['text'],
+                "tokens": _pack_tokens(tokens, token_dtype),
                 "metadata": {
                     "source": "mysql",
-                    "processed_at": datetime.utcnow().isoformat(),
+                    "processed_at": processed_at,
                     "tokenizer": tokenizer_model,
-                    "token_count": len(tokens)
+                    "token_count": len(tokens),
+                    "token_dtype": token_dtype
                 }
-            }
-            
+            })
+        return documents
+    
+    documents_batch = []
+    
+    def insert_batch():
+        nonlocal total_inserted
+        load_collection.insert_many(documents_batch, ordered=False, bypass_document_validation=True)
+        total_inserted += len(documents_batch)
+        print(f"  Inserted {total_inserted}/{total_count} documents...", end='\r')
+        documents_batch.clear()
+    
+    def insert_documents(documents):
+        # Carry documents across tokenizer batches so every insert is a full batch
+        for document in documents:
             documents_batch.append(document)
-            
-            # Insert batch when it reaches batch_size
             if len(documents_batch) >= batch_size:
-                mongo_collection.insert_many(documents_batch)
-                total_inserted += len(documents_batch)
-                print(f"  Inserted {total_inserted}/{total_count} documents...", end='\r')
-                documents_batch = []
-        
-        # Insert remaining documents
+                insert_batch()
+    
+    def insert_remaining():
         if documents_batch:
-            mongo_collection.insert_many(documents_batch)
-            total_inserted += len(documents_batch)
+            insert_batch()
+    
+    try:
+        # Read pages from MySQL, tokenize and insert into MongoDB concurrently
+        staged_rows = chain.from_iterable(_iter_text_pages(cursor, MYSQL_PAGE_SIZE))
+        _run_pipeline(
+            _iter_batches(staged_rows, TOKENIZE_BATCH_SIZE),
+            build_documents,
+            insert_documents,
+            insert_remaining
+        )
         
         print(f"\n✓ Successfully inserted {total_inserted} documents into MongoDB")
         
     except Exception as e:
         print(f"\n✗ Error processing data: {e}")
-        mysql_conn.close()
-        mongo_client.close()
+        cursor.close()
+        if index_specs:
+            print(f"\nRebuilding {len(index_specs)} secondary indexes...")
+            # Log rebuild errors so they don't mask the error from the load
+            try:
+                _restore_indexes(mongo_collection, index_specs)
+                print("✓ Indexes rebuilt")
+            except Exception as restore_error:
+                print(f"✗ Error rebuilding indexes: {restore_error}")
         raise
     
+    if index_specs:
+        print(f"\nRebuilding {len(index_specs)} secondary indexes...")
+        try:
+            _restore_indexes(mongo_collection, index_specs)
+        except Exception as e:
+            print(f"✗ Error rebuilding indexes: {e}")
+            cursor.close()
+            raise
+        print("✓ Indexes rebuilt")
+    
     # Step 6: Verify the insertion
     print("\nVerifying data insertion...")
     try:
@@ -183,15 +491,14 @@ def process_to_curated(db_host, db_user, db_password, db_name,
             print(f"    ID: {doc['id']}")
             print(f"    Text preview: {doc['text'][:80]}...")
             print(f"    Token count: {doc['metadata']['token_count']}")
-            print(f"    First 10 tokens: {doc['tokens'][:10]}...")
+            tokens = np.frombuffer(doc['tokens'], dtype=doc['metadata']['token_dtype'])
+            print(f"    First 10 tokens: {tokens[:10].tolist()}...")
         
     except Exception as e:
         print(f"✗ Error verifying data: {e}")
     finally:
         cursor.close()
-        mysql_conn.close()
-        mongo_client.close()
-        print("\n✓ All database connections closed")
+        print("\n✓ MySQL cursor closed (connections kept open for reuse)")
 
 
 if __name__ == "__main__":
@@ -208,19 +515,23 @@ if __name__ == "__main__":
     parser.add_argument("--mongo_collection_name", type=str, default="wikitext", help="MongoDB collection name")
     parser.add_argument("--tokenizer_model", type=str, default="distilbert-base-uncased", 
                        help="Hugging Face tokenizer model (e.g., 'distilbert-base-uncased' or 'gpt2')")
-    parser.add_argument("--batch_size", type=int, default=100, help="Batch size for MongoDB inserts")
+    parser.add_argument("--batch_size", type=int, default=1000, help="Batch size for MongoDB inserts")
     
     args = parser.parse_args()
     
-    process_to_curated(
-        args.db_host,
-        args.db_user,
-        args.db_password,
-        args.db_name,
-        args.mongo_host,
-        args.mongo_port,
-        args.mongo_db_name,
-        args.mongo_collection_name,
-        args.tokenizer_model,
-        args.batch_size
-    )
\ No newline at end of file
+    try:
+        process_to_curated(
+            args.db_host,
+            args.db_user,
+            args.db_password,
+            args.db_name,
+            args.mongo_host,
+            args.mongo_port,
+            args.mongo_db_name,
+            args.mongo_collection_name,
+            args.tokenizer_model,
+            args.batch_size
+        )
+    finally:
+        close_connections()
+        print("✓ All database connections closed")
\ No newline at end of file
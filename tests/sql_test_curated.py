@@ -1,5 +1,7 @@
 import pymysql
 import pymongo
+import numpy as np
+from bson import Binary
 from transformers import AutoTokenizer
 from datetime import datetime
 
@@ -10,7 +12,8 @@ mysql_conn = pymysql.connect(
     password="root",
     database="staging"
 )
-cursor = mysql_conn.cursor(pymysql.cursors.DictCursor)
+# Unbuffered cursor: rows are streamed from the server
+cursor = mysql_conn.cursor(pymysql.cursors.SSDictCursor)
 
 # Query all texts from MySQL
 cursor.execute("SELECT * FROM texts")
@@ -23,34 +26,46 @@ mongo_collection = mongo_db["wikitext"]
 # Load tokenizer
 tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
 
-# Process each row
+# Process rows in batches
+batch_size = 1000
 count = 0
-for row in cursor:
-    # Tokenize the text
-    tokens = tokenizer(
-        row["text"], 
-        truncation=True, 
-        padding=True,
-        max_length=128
+while True:
+    rows = cursor.fetchmany(batch_size)
+    if not rows:
+        break
+    
+    # One timestamp per batch
+    processed_at = datetime.utcnow()
+    
+    # Tokenize the whole batch in one call
+    batch_tokens = tokenizer(
+        [row["text"] for row in rows],
+        truncation=True,
+        padding=False,
+        max_length=128,
+        return_attention_mask=False,
+        return_token_type_ids=False
     )["input_ids"]
     
-    # Create document
-    document = {
-        "id": row["id"],
-        "text": row["text"],
-        "tokens": tokens,
-        "metadata": {
-            "source": "mysql",
-            "processed_at": datetime.utcnow().isoformat()
+    # Create documents
+    documents = [
+        {
+            "id": row["id"],
+            "text": row["text"],
+            "tokens": Binary(np.asarray(tokens, dtype=np.uint16).tobytes()),
+            "metadata": {
+                "source": "mysql",
+                "processed_at": processed_at,
+                "token_dtype": "uint16"
+            }
         }
-    }
+        for row, tokens in zip(rows, batch_tokens)
+    ]
     
     # Insert into MongoDB
-    mongo_collection.insert_one(document)
-    count += 1
-    
-    if count % 100 == 0:
-        print(f"Processed {count} documents...")
+    mongo_collection.insert_many(documents, ordered=False)
+    count += len(documents)
+    print(f"Processed {count} documents...")
 
 print(f"Data successfully inserted into MongoDB collection 'wikitext': {count} documents")
 